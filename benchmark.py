@@ -0,0 +1,191 @@
+"""Load benchmark for the message handling path.
+Pushes chat messages and !servers commands through ServerListClient
+using the offline Discord stand-in and fake A2S replies.
+
+python benchmark.py --messages 20000 --rate 5000
+"""
+
+# Standard libraries
+import argparse
+import asyncio
+import configparser
+import logging
+import random
+import time
+from types import SimpleNamespace
+from unittest import mock
+
+from ssdb_core import logger, percentile
+from ssdb_client import ServerListClient
+from fake_discord import FakeDiscord, FakeClientMixin
+
+
+CHANNEL_ID = 1
+COMMANDS = ('!servers', '!serverlist', '!list')
+
+
+class FakeServerListClient(FakeClientMixin, ServerListClient):
+    pass
+
+
+class QueryCounter:
+    """Counts query passes and how many of them overlapped another one."""
+
+    def __init__(self, client: ServerListClient):
+        self.passes = 0
+        self.duplicates = 0
+        self.a2s_requests = 0
+        self.in_flight = 0
+
+        query_newlist = client.query_newlist
+
+        async def counted_query_newlist():
+            self.passes += 1
+            if self.in_flight > 0:
+                self.duplicates += 1
+            self.in_flight += 1
+            try:
+                return await query_newlist()
+            finally:
+                self.in_flight -= 1
+
+        client.query_newlist = counted_query_newlist
+
+    def make_ainfo(self, latency: float):
+        async def ainfo(address, timeout=3.0, encoding='utf-8'):
+            self.a2s_requests += 1
+            await asyncio.sleep(latency * random.uniform(0.5, 1.5))
+            return SimpleNamespace(
+                player_count=address[1] % 32,
+                bot_count=0,
+                max_players=32,
+                server_name="Server %i" % address[1],
+                map_name="dm_test")
+        return ainfo
+
+
+def make_config(args):
+    config = configparser.ConfigParser()
+    config.read_dict({'config': {
+        'channel': str(CHANNEL_ID),
+        'serverlist': ','.join(
+            '127.0.0.1:%i' % (27015 + i) for i in range(args.servers)),
+        'gamedir': '',
+        'embed_title': 'Servers',
+        'embed_max': '10',
+        'server_query_interval': str(args.server_query_interval),
+        'max_new_msgs': '5',
+        'upper_format': '{players}/{max_players} | {name}',
+        'lower_format': 'Map: {map} | Connect: `connect {address}`',
+    }})
+    return config
+
+
+def summarize(name: str, latencies: list[float]):
+    if not latencies:
+        print("%-10s %8i" % (name, 0))
+        return
+    print("%-10s %8i %9.3f %9.3f %9.3f %9.3f" % (
+        name,
+        len(latencies),
+        percentile(latencies, 50) * 1000,
+        percentile(latencies, 90) * 1000,
+        percentile(latencies, 99) * 1000,
+        max(latencies) * 1000))
+
+
+async def run(args):
+    fake = FakeDiscord()
+    channel = fake.add_channel(
+        CHANNEL_ID,
+        http_latency=args.http_latency,
+        rate_limit=args.rate_limit,
+        rate_limit_period=args.rate_limit_period)
+
+    client = FakeServerListClient(make_config(args))
+    fake.attach(client)
+    counter = QueryCounter(client)
+
+    with mock.patch('a2s.ainfo', counter.make_ainfo(args.a2s_latency)):
+        await client.on_ready()
+        await fake.drain()
+
+        async def update_loop():
+            while True:
+                await asyncio.sleep(args.update_interval)
+                await client.update_task()
+
+        updater = asyncio.create_task(update_loop())
+
+        chat: list[asyncio.Task] = []
+        commands: list[asyncio.Task] = []
+        start = time.perf_counter()
+
+        for i in range(args.messages):
+            # Keep to the requested rate.
+            delay = start + i / args.rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            if random.random() < args.command_ratio:
+                commands.append(channel.post(random.choice(COMMANDS)))
+            else:
+                chat.append(channel.post("hello %i" % i))
+
+            # Don't keep the whole history around.
+            if len(channel.messages) > 100:
+                del channel.messages[:50]
+
+        pushed = time.perf_counter() - start
+        await fake.drain()
+        elapsed = time.perf_counter() - start
+
+        updater.cancel()
+
+    print("Pushed %i messages (%i commands) in %.2fs, %.0f msg/s" % (
+        args.messages, len(commands), pushed, args.messages / pushed))
+    print("Handled all of them in %.2fs" % elapsed)
+    print()
+    print("%-10s %8s %9s %9s %9s %9s" % (
+        "handler", "count", "p50 ms", "p90 ms", "p99 ms", "max ms"))
+    summarize("chat", [task.result() for task in chat])
+    summarize("command", [task.result() for task in commands])
+    print()
+    print("Query passes:      %i (%i overlapping another pass)" % (
+        counter.passes, counter.duplicates))
+    print("A2S requests:      %i" % counter.a2s_requests)
+    print("Discord writes:    %i (%i sends, %i edits, %i deletes)" % (
+        channel.writes, channel.sends, channel.edits, channel.deletes))
+    print("Rate limited (429): %i (%.2fs waited, summed over writes)" % (
+        channel.rate_limited, channel.rate_limit_wait))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=10000,
+                        help="How many messages to push.")
+    parser.add_argument('--rate', type=float, default=2000,
+                        help="Messages per second.")
+    parser.add_argument('--command-ratio', type=float, default=0.1,
+                        help="Fraction of messages that are !servers commands.")
+    parser.add_argument('--servers', type=int, default=20,
+                        help="How many servers are in the list.")
+    parser.add_argument('--a2s-latency', type=float, default=0.05,
+                        help="Average A2S round trip time in seconds.")
+    parser.add_argument('--http-latency', type=float, default=0.05,
+                        help="Discord HTTP latency in seconds.")
+    parser.add_argument('--rate-limit', type=int, default=5,
+                        help="Writes allowed per rate limit period, 0 disables.")
+    parser.add_argument('--rate-limit-period', type=float, default=5,
+                        help="Rate limit period in seconds.")
+    parser.add_argument('--server-query-interval', type=float, default=1,
+                        help="server_query_interval config option.")
+    parser.add_argument('--update-interval', type=float, default=3,
+                        help="How often the update task runs.")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    # Logging would drown out the results.
+    logger.addHandler(logging.NullHandler())
+    asyncio.run(run(args))
@@ -0,0 +1,175 @@
+"""Startup benchmark.
+Starts SSDB in fresh processes the way ssdb.py does, against the offline
+Discord stand-in, and reports how long imports, config validation and
+the first embed take.
+
+python benchmark_startup.py --runs 10
+"""
+
+# Imported first so we can time everything else.
+import time
+START = time.perf_counter()
+
+# Standard libraries
+import argparse
+import asyncio
+import configparser
+import json
+import statistics
+import subprocess
+import sys
+import tempfile
+from os import path
+from types import SimpleNamespace
+from unittest import mock
+
+
+CHANNEL_ID = 1
+MILESTONES = (
+    ('import_ssdb', "import ssdb_core"),
+    ('config', "config validated"),
+    ('import_client', "import ssdb_client"),
+    ('first_embed', "first embed"),
+)
+
+
+def write_config(args, config_name: str):
+    config = configparser.ConfigParser()
+    config.read_dict({'config': {
+        'token': 'fake',
+        'channel': str(CHANNEL_ID),
+        'serverlist': '' if args.gamedir else ','.join(
+            '127.0.0.1:%i' % (27015 + i) for i in range(args.servers)),
+        'gamedir': args.gamedir,
+        'embed_title': 'Servers',
+        'upper_format': '{players}/{max_players} | {name}',
+        'lower_format': 'Map: {map} | Connect: `connect {address}`',
+        'logging': 'critical',
+    }})
+    with open(config_name, 'w') as fp:
+        config.write(fp)
+
+
+async def fake_ainfo(address, timeout=3.0, encoding='utf-8'):
+    await asyncio.sleep(0.05)
+    return SimpleNamespace(player_count=1, bot_count=0, max_players=32,
+                           server_name="Server %i" % address[1],
+                           map_name="dm_test")
+
+
+def fake_query_master(filter_text):
+    for i in range(20):
+        yield ('127.0.0.1', 27015 + i)
+
+
+def child(args):
+    """Starts the bot once through ssdb_core.main, like ssdb.py does,
+    and prints the milestones as JSON."""
+    times = {}
+
+    import ssdb_core
+    times['import_ssdb'] = time.perf_counter() - START
+
+    validate_config = ssdb_core.validate_config
+
+    def timed_validate_config(config):
+        validate_config(config)
+        times['config'] = time.perf_counter() - START
+
+    def run_client(client_class, config):
+        times['import_client'] = time.perf_counter() - START
+
+        from fake_discord import FakeDiscord, FakeClientMixin
+
+        class FakeServerListClient(FakeClientMixin, client_class):
+            pass
+
+        async def run():
+            fake = FakeDiscord()
+            channel = fake.add_channel(
+                CHANNEL_ID, http_latency=args.http_latency)
+            client = FakeServerListClient(config)
+            fake.attach(client)
+
+            await client.setup_hook()
+            # Connecting to the gateway.
+            await asyncio.sleep(args.login_latency)
+            await client.on_ready()
+            while not channel.writes:
+                await asyncio.sleep(0.001)
+            times['first_embed'] = time.perf_counter() - START
+
+            client.update_task.cancel()
+
+        patches = [mock.patch('a2s.ainfo', fake_ainfo)]
+        if args.gamedir:
+            patches.append(mock.patch(
+                'steam.game_servers.query_master', fake_query_master))
+        for patch in patches:
+            patch.start()
+
+        asyncio.run(run())
+        return 0
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        config_name = path.join(tmp_dir, '.ssdb_config.ini')
+        write_config(args, config_name)
+        with mock.patch.object(
+                ssdb_core, 'validate_config', timed_validate_config):
+            ssdb_core.main(config_name, run_client)
+
+    times['modules'] = [
+        name for name in ('discord', 'a2s', 'steam') if name in sys.modules]
+    print(json.dumps(times))
+
+
+def main(args):
+    cmd = [sys.executable, __file__, '--child',
+           '--servers', str(args.servers),
+           '--login-latency', str(args.login_latency),
+           '--http-latency', str(args.http_latency)]
+    if args.gamedir:
+        cmd.extend(('--gamedir', args.gamedir))
+
+    runs = []
+    for _ in range(args.runs):
+        start = time.perf_counter()
+        output = subprocess.run(
+            cmd, check=True, capture_output=True, text=True).stdout
+        result = json.loads(output.splitlines()[-1])
+        result['process'] = time.perf_counter() - start
+        runs.append(result)
+
+    print("%i runs, %s mode, %.2fs simulated login" % (
+        args.runs, 'gamedir' if args.gamedir else 'serverlist',
+        args.login_latency))
+    print()
+    print("%-20s %9s %9s" % ("milestone", "median ms", "max ms"))
+    for key, name in MILESTONES + (('process', "process exit"),):
+        values = [run[key] for run in runs]
+        print("%-20s %9.1f %9.1f" % (
+            name, statistics.median(values) * 1000, max(values) * 1000))
+    print()
+    print("Modules loaded: %s" % ", ".join(runs[-1]['modules']))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5,
+                        help="How many times to start the bot.")
+    parser.add_argument('--servers', type=int, default=20,
+                        help="How many servers are in the serverlist.")
+    parser.add_argument('--gamedir', default='',
+                        help="Use master server mode with this gamedir.")
+    parser.add_argument('--login-latency', type=float, default=0.5,
+                        help="How long connecting to Discord takes in seconds.")
+    parser.add_argument('--http-latency', type=float, default=0.05,
+                        help="Discord HTTP latency in seconds.")
+    parser.add_argument('--child', action='store_true',
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args)
+    else:
+        main(args)
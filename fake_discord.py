@@ -0,0 +1,226 @@
+"""Offline stand-in for the parts of Discord SSDB uses.
+Lets ServerListClient run without a bot token or a network connection,
+for tests and benchmarks."""
+
+# Standard libraries
+import asyncio
+import contextvars
+import itertools
+import time
+from collections import deque
+
+# Module: discord.py
+import discord
+
+
+# How many times discord.py tries a request before giving up.
+HTTP_TRIES = 5
+
+
+class FakeResponse:
+    """Just enough of aiohttp's response for discord.HTTPException."""
+
+    def __init__(self, status: int, reason: str):
+        self.status = status
+        self.reason = reason
+
+
+class FakeMessage:
+    def __init__(self, channel: 'FakeChannel', id: int,
+                 content: str = '', embed: discord.Embed | None = None):
+        self.channel = channel
+        self.id = id
+        self.content = content
+        self.embed = embed
+
+    async def edit(self, embed: discord.Embed | None = None):
+        await self.channel.write('edit')
+        if self not in self.channel.messages:
+            raise discord.NotFound(
+                FakeResponse(404, 'Not Found'), 'Unknown Message')
+        self.embed = embed
+
+    async def delete(self):
+        await self.channel.write('delete')
+        if self not in self.channel.messages:
+            raise discord.NotFound(
+                FakeResponse(404, 'Not Found'), 'Unknown Message')
+        self.channel.messages.remove(self)
+        self.channel.discord.dispatch('message_delete', self)
+
+
+class FakeChannel:
+    """A text channel. Writes (send, edit, delete) take http_latency
+    seconds and are answered with 429 when there are more than
+    rate_limit of them in rate_limit_period seconds. Like discord.py,
+    a rate limited write waits for the bucket to reset and tries again,
+    and only fails after HTTP_TRIES tries."""
+
+    def __init__(self, fake: 'FakeDiscord', id: int, name: str,
+                 http_latency: float = 0.0,
+                 rate_limit: int = 0, rate_limit_period: float = 5.0):
+        self.discord = fake
+        self.id = id
+        self.name = name
+        self.http_latency = http_latency
+        self.rate_limit = rate_limit
+        self.rate_limit_period = rate_limit_period
+
+        self.messages: list[FakeMessage] = []
+        self.write_times: deque[float] = deque()
+
+        self.sends = 0
+        self.edits = 0
+        self.deletes = 0
+        self.rate_limited = 0
+        self.rate_limit_wait = 0.0  # Seconds spent waiting for the bucket
+
+    def get_retry_after(self):
+        """Takes a slot in the bucket and returns 0, or returns how long
+        until there is one."""
+        if self.rate_limit <= 0:
+            return 0
+
+        curtime = time.monotonic()
+        while (self.write_times and
+               curtime - self.write_times[0] >= self.rate_limit_period):
+            self.write_times.popleft()
+        if len(self.write_times) >= self.rate_limit:
+            return self.rate_limit_period - (curtime - self.write_times[0])
+
+        self.write_times.append(curtime)
+        return 0
+
+    async def write(self, kind: str):
+        for _ in range(HTTP_TRIES):
+            if self.http_latency > 0:
+                await asyncio.sleep(self.http_latency)
+
+            retry_after = self.get_retry_after()
+            if retry_after > 0:
+                self.rate_limited += 1
+                self.rate_limit_wait += retry_after
+                await asyncio.sleep(retry_after)
+                continue
+
+            if kind == 'send':
+                self.sends += 1
+            elif kind == 'edit':
+                self.edits += 1
+            elif kind == 'delete':
+                self.deletes += 1
+            return
+
+        raise discord.HTTPException(
+            FakeResponse(429, 'Too Many Requests'),
+            {'code': 0, 'message': 'You are being rate limited.'})
+
+    @property
+    def writes(self):
+        return self.sends + self.edits + self.deletes
+
+    async def fetch_message(self, id: int):
+        for msg in self.messages:
+            if msg.id == id:
+                return msg
+        raise discord.NotFound(
+            FakeResponse(404, 'Not Found'), 'Unknown Message')
+
+    async def history(self, limit: int | None = 100):
+        """Newest messages first, like discord.py."""
+        for msg in list(reversed(self.messages))[:limit]:
+            yield msg
+
+    async def send(self, content: str = '', embed: discord.Embed | None = None):
+        await self.write('send')
+        msg = self.add_message(content, embed)
+        self.discord.dispatch('message', msg)
+        return msg
+
+    def add_message(self, content: str = '', embed: discord.Embed | None = None):
+        msg = FakeMessage(self, self.discord.next_id(), content, embed)
+        self.messages.append(msg)
+        return msg
+
+    def post(self, content: str):
+        """Somebody else writes a message into the channel.
+        Returns the on_message task."""
+        return self.discord.dispatch('message', self.add_message(content))
+
+
+class FakeDiscord:
+    """Holds the fake channels and dispatches events to the client
+    the same way the gateway would: as separate tasks after the fact."""
+
+    def __init__(self):
+        self.channels: dict[int, FakeChannel] = {}
+        self.client: discord.Client | None = None
+        self.events: set[asyncio.Task] = set()
+        self.ids = itertools.count(1000000000000000000)
+
+    def next_id(self):
+        return next(self.ids)
+
+    def add_channel(self, id: int, name: str = 'servers', **kwargs):
+        channel = FakeChannel(self, id, name, **kwargs)
+        self.channels[id] = channel
+        return channel
+
+    def attach(self, client: discord.Client):
+        client.fake_discord = self
+        self.client = client
+
+    def dispatch(self, event: str, *args):
+        """Runs the client's on_<event> handler as a task.
+        The task returns how long the handler took."""
+        handler = getattr(self.client, 'on_' + event, None)
+        if not handler:
+            return None
+
+        async def run():
+            start = time.perf_counter()
+            await handler(*args)
+            return time.perf_counter() - start
+
+        # Gateway events don't carry the context of whoever caused them.
+        task = asyncio.get_running_loop().create_task(
+            run(), context=contextvars.Context())
+        self.events.add(task)
+        task.add_done_callback(self.events.discard)
+        return task
+
+    async def drain(self):
+        """Waits until every dispatched event has been handled."""
+        while self.events:
+            await asyncio.gather(*self.events, return_exceptions=True)
+
+
+class FakeClientMixin:
+    """Put this before discord.Client in the bases to talk to
+    a FakeDiscord instead of the real thing."""
+
+    fake_discord: FakeDiscord
+
+    @property
+    def user(self):
+        return 'FakeBot#0000'
+
+    def is_ready(self):
+        return True
+
+    async def wait_until_ready(self):
+        pass
+
+    def get_channel(self, id: int, /):
+        return self.fake_discord.channels.get(id)
+
+    def get_all_channels(self):
+        yield from self.fake_discord.channels.values()
+
+    # Don't touch the real persistent message file.
+    def read_persistent_last_msg(self):
+        pass
+
+    def write_persistent_last_msg(self):
+        assert self.cur_msg
+        self.persistent_msg_id = self.cur_msg.id
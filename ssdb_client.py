@@ -0,0 +1,489 @@
+"""The Discord side of SSDB. Kept apart from ssdb_core.py so we only
+import discord.py once we actually run the bot."""
+
+# Standard libraries
+import time
+import asyncio
+import configparser
+import socket
+from os import path
+
+# Module: discord.py
+import discord
+from discord.ext import tasks
+
+from ssdb_core import (logger, ServerList, ServerData, ServerListConfig,
+                       ProbePolicy, Tracer, address_to_str, address_equals,
+                       parse_ips)
+
+
+class ServerListClient(discord.Client):
+    """Task: Prints an embed list of servers.
+    Responds to commands (!serverlist/!servers) whenever possible."""
+
+    def __init__(self, config: configparser.ConfigParser):
+        intents = discord.Intents.default()
+        intents.message_content = True
+        super().__init__(intents=intents)
+        # The Channel ID we will use
+        self.channel_id = config.getint(
+            'config', 'channel', fallback=0)
+        self.config = ServerListConfig(config)
+        self.user_serverlist = parse_ips(
+            config.get('config', 'serverlist', fallback=''))
+        self.user_blacklist = parse_ips(
+            config.get('config', 'blacklist', fallback=''))
+
+        self.serverlist = ServerList()
+        self.probe_policy = ProbePolicy(
+            self.config.query_timeout, self.config.query_retries)
+        self.tracer = Tracer(
+            self.config.slow_cycle_threshold, self.config.slow_cycle_profile)
+        self.last_action_time = 0.0  # Last time we edited or printed a message
+        self.last_print_time = 0.0
+        self.last_query_time = 0.0
+        self.last_ms_query_time = 0.0
+        self.num_offline = 0  # Number of servers we couldn't contact
+        self.cur_msg = None  # The message we should edit
+        self.persistent_msg_id = 0
+        self.num_other_msgs = 0  # How many messages between our msg and now
+        self.init_done = False
+        self.query_task: asyncio.Task | None = None
+        # Held while we decide between a new message and an edit.
+        self.print_lock = asyncio.Lock()
+
+        self.read_persistent_last_msg()
+
+    #
+    # Discord.py events
+    #
+    async def setup_hook(self):
+        # Start querying servers while we're still connecting.
+        self.start_query()
+        self.update_task.start()
+
+    async def on_ready(self):
+        logger.info(f"Logged on as {self.user}")
+
+        # Make sure our channel id is valid
+        channel = self.get_channel(self.channel_id)
+        if not channel:
+            logger.warning("Invalid channel id %s!" % self.channel_id)
+            channel = next(self.get_all_channels())
+            self.channel_id = channel.id
+            logger.warning("Using channel %s instead!" % channel.name)
+
+        # Find the last time we said something
+        limit = 6
+
+        try:
+            self.cur_msg = await channel.fetch_message(
+                self.persistent_msg_id)
+        except discord.NotFound:
+            logger.debug(f"Could not find persistent message by id {self.persistent_msg_id}.")
+        except Exception as e:
+            logger.error(f"Failed to fetch message persistent last message. Exception: {e}")
+
+        if self.cur_msg:
+            logger.info(f"Found last message {self.cur_msg.id}")
+
+        async for msg in channel.history(limit=limit):
+            if self.cur_msg and msg.id == self.cur_msg.id:
+                break
+            self.num_other_msgs += 1
+            # We didn't find anything, just print a new list
+            if self.num_other_msgs >= limit:
+                await self.print_list()
+                break
+
+        self.init_done = True
+
+        # Show the list we queried while connecting right away
+        # instead of waiting for the update task.
+        if not self.last_action_time:
+            await self.print_list()
+
+    async def on_message(self, message: discord.Message):
+        # Not cached yet.
+        if not self.is_ready():
+            return
+        if not self.init_done:
+            logger.debug("Can't react to message, initializing not done yet.")
+            return
+        # Listen for commands in our channel only.
+        if message.channel.id != self.channel_id:
+            return
+        # This is our message, ignore it.
+        if self.cur_msg and message.id == self.cur_msg.id:
+            return
+
+        self.num_other_msgs += 1
+        logger.debug(f"New message. {self.num_other_msgs} messages after our list.")
+
+        if not message.content or message.content[0] != '!':
+            return
+        if not self.should_query() and not self.should_print_new_msg():
+            return
+        if message.content[1:] in ('servers', 'serverlist', 'list'):
+            await self.print_list()
+
+    async def on_message_delete(self, message: discord.Message):
+        # Not cached yet.
+        if not self.is_ready():
+            return
+        if not self.init_done:
+            logger.debug("Can't react to message deletion, initializing not done yet.")
+            return
+        if not self.cur_msg:
+            return
+        if self.cur_msg.id == message.id:
+            self.cur_msg = None  # Our message, clear cache
+            logger.debug(f"Our message was removed.")
+        if message.channel.id == self.channel_id and message.id > self.cur_msg.id:
+            self.num_other_msgs -= 1
+            if self.num_other_msgs < 0:
+                self.num_other_msgs = 0
+            logger.debug(f"Removed message. {self.num_other_msgs} messages after our list.")
+
+    @tasks.loop(seconds=3)
+    async def update_task(self):
+        """The update loop where we query servers."""
+        if not self.init_done:
+            logger.debug("Can't update list because initializing not done yet.")
+            return
+        if self.should_query():
+            await self.print_list()
+
+    @update_task.before_loop
+    async def before_update_task(self):
+        # Wait until we're ready.
+        await self.wait_until_ready()
+
+    #
+    # Our stuff
+    #
+    async def query_newlist(self):
+        """Returns the server list depending on the configuration options."""
+        self.num_offline = 0
+
+        new_lst = None
+
+        if self.user_serverlist:
+            # User wants a specific list from ips.
+            new_lst = await self.query_servers(self.user_serverlist)
+        elif self.should_query_last_list():
+            # Query the servers we've already collected.
+            addresses = self.serverlist.get_addresses()
+            new_lst = await self.query_servers(addresses)
+        else:
+            # Just query masterserver.
+            addresses = await self.query_masterserver(self.config.gamedir)
+            new_lst = await self.query_servers(addresses)
+
+        self.last_query_time = time.time()
+
+        return new_lst
+
+    async def query_masterserver(self, gamedir: str):
+        """Queries the Source master server list and returns all
+        addresses found.
+        Should keep these queries to the minimum,
+        or you get timed out."""
+        logger.info("Querying masterserver...")
+
+        # TODO: More options?
+        with self.tracer.span('query_masterserver') as span:
+            # The walk blocks, keep it off the event loop.
+            ret = await asyncio.get_running_loop().run_in_executor(
+                None,
+                self.walk_masterserver, gamedir)
+            span.count('servers', len(ret))
+        self.last_ms_query_time = time.time()
+
+        return ret
+
+    def walk_masterserver(self, gamedir: str):
+        # Module: steam
+        # Only needed for gamedir and pulls in a lot, so import it here.
+        import steam.game_servers
+
+        ret = []
+
+        # Runs in the executor, which the profiler doesn't watch by itself.
+        try:
+            with self.tracer.sample_thread():
+                max_total_query_time = self.config.max_total_query_time
+                query_start = time.time()
+
+                for address in steam.game_servers.query_master("\\gamedir\\" + gamedir):
+                    if self.is_blacklisted(address):
+                        continue
+
+                    ret.append(address)
+
+                    if (time.time() - query_start) > max_total_query_time:
+                        break
+        except (OSError, ConnectionError, RuntimeError) as e:
+            logger.error(
+                "Connection error querying master server: " + str(e))
+
+        return ret
+
+    async def query_servers(self, addresses: list[tuple[str, int]]):
+        logger.info("Querying %i servers..." % (len(addresses)))
+
+        srv_lst = ServerList()
+        self.probe_policy.prune(addresses)
+        semaphore = asyncio.Semaphore(self.config.max_concurrent_queries)
+
+        async def query(address: tuple[str, int]):
+            async with semaphore:
+                return await self.query_server_info(address)
+
+        with self.tracer.span('query_servers') as span:
+            # Query servers concurrently so slow servers don't hold up the rest.
+            queries = [asyncio.create_task(query(address))
+                       for address in addresses]
+            pending = set()
+            if queries:
+                _, pending = await asyncio.wait(
+                    queries, timeout=self.config.max_total_query_time)
+                for task in pending:
+                    task.cancel()
+                await asyncio.gather(*pending, return_exceptions=True)
+
+            for address, task in zip(addresses, queries):
+                if task.cancelled():
+                    continue
+                info = task.result()
+                if info:
+                    srv = ServerData(address)
+                    srv.update_info(info)
+                    srv_lst.add_server(srv)
+
+            span.count('servers', len(queries))
+            span.count('timed_out', len(pending))
+            span.count('online', len(srv_lst.servers))
+
+        srv_lst.query_time = time.time()
+
+        return srv_lst
+
+    async def query_server_info(self, address: tuple[str, int]):
+        # logger.info("Querying server %s..." % (address_to_str(address)))
+
+        # Module: python-a2s
+        import a2s
+
+        try:
+            info = await self.probe_policy.query(address)
+            return info
+        except asyncio.TimeoutError:
+            logger.info(
+                "Couldn't contact server %s!" % address_to_str(address))
+            self.num_offline += 1
+        except (a2s.BrokenMessageError,
+                a2s.BufferExhaustedError,
+                socket.gaierror,
+                ConnectionError,
+                OSError) as e:
+            logger.error(
+                "Connection error querying server: %s" % (e))
+            self.num_offline += 1
+
+        return None
+
+    async def get_serverlist(self):
+        if self.query_task or self.should_query():
+            task = self.start_query()
+            with self.tracer.span('wait_query') as span:
+                span.link(await asyncio.shield(task))
+        return self.serverlist
+
+    def start_query(self):
+        """Starts updating the server list unless we're already doing it.
+        Everybody who wants the list waits for the same query."""
+        if not self.query_task:
+            self.query_task = asyncio.create_task(self.update_serverlist())
+        return self.query_task
+
+    async def update_serverlist(self):
+        """Returns the span of the update.
+        The query is shared, so it's its own cycle instead of a part of
+        whoever started it."""
+        try:
+            with self.tracer.span('update_serverlist', root=True) as cycle:
+                new_lst = await self.query_newlist()
+                with self.tracer.span('serverlist_update') as span:
+                    self.serverlist.update(
+                        new_lst, self.config.max_unresponsive_time)
+                    span.count('servers', len(self.serverlist.servers))
+            return cycle
+        finally:
+            self.query_task = None
+
+    def is_blacklisted(self, address: tuple[str, int]):
+        for blacklisted in self.user_blacklist:
+            if address_equals(blacklisted, address):
+                return True
+        return False
+
+    def should_query(self):
+        # We haven't even queried yet
+        if len(self.serverlist.servers) < 1:
+            return True
+
+        time_delta = time.time() - self.last_query_time
+        if time_delta > self.config.server_query_interval:
+            return True
+        else:
+            return False
+
+    async def print_list(self):
+        with self.tracer.span('print_list'):
+            lst = await self.get_serverlist()
+
+            if not lst:
+                logger.info("Nothing to print!")
+                return
+
+            # Everybody waiting for the same query wakes up at once,
+            # only the first one may print a new message.
+            async with self.print_lock:
+                if self.should_print_new_msg():
+                    await self.send_newlist(lst)
+                else:
+                    await self.send_editlist(lst)
+
+    def should_print_new_msg(self):
+        if self.cur_msg is None:
+            return True
+
+        # Too many messages to see it
+        if self.num_other_msgs > self.config.max_new_msgs:
+            return True
+
+        return False
+
+    def should_query_last_list(self):
+        if len(self.serverlist.servers) < 1:
+            return False
+
+        time_delta = time.time() - self.last_ms_query_time
+        return True if time_delta < self.config.query_interval else False
+
+    def build_serverlist_embed(self, lst: ServerList):
+        # Sort according to player count
+        servers = sorted(
+            lst.servers,
+            key=lambda srv: srv.ply_count,
+            reverse=True)
+        # I just had a deja vu...
+        # ABOUT THIS EXACT CODE AND ME EXPLAINING IT IN THIS COMMENT
+        # FREE WILL IS A LIE
+        # WE LIVE IN A SIMULATION
+        description = "%i server(s) online" % (len(servers))
+
+        if self.num_offline > 0:
+            description += ", %i offline" % self.num_offline
+
+        description += ("\nUpdating every %i seconds" %
+                        (self.config.server_query_interval))
+
+        em = discord.Embed(
+            title=self.config.embed_title,
+            description=description,
+            colour=self.config.embed_color)
+        counter = 0
+        for srv in servers:
+            kwargs = {
+                "name": srv.server_name,
+                "address": srv.full_socket,
+                "map": srv.map_name,
+                "players": srv.ply_count,
+                "max_players": srv.max_ply_count
+            }
+
+            em.add_field(
+                name=self.config.upper_format.format(**kwargs),
+                value=self.config.lower_format.format(**kwargs),
+                inline=False)
+
+            counter += 1
+            if counter >= self.config.embed_max:
+                break
+
+        return em
+
+    async def send_newlist(self, lst: ServerList):
+        channel = self.get_channel(self.channel_id)
+
+        self.num_other_msgs = 0
+        curtime = time.time()
+
+        # Remove old message.
+        await self.remove_oldlist()
+
+        try:
+            with self.tracer.span('build_embed') as span:
+                embed = self.build_serverlist_embed(lst)
+                span.count('fields', len(embed.fields))
+            with self.tracer.span('discord_send'):
+                self.cur_msg = await channel.send(embed=embed)
+            self.last_print_time = self.last_action_time = curtime
+            logger.info("Printed new list.")
+
+            # Make sure we remember this message.
+            if self.cur_msg.id != self.persistent_msg_id:
+                self.write_persistent_last_msg()
+        except Exception as e:
+            logger.error(
+                "Failed to print new list. Exception: %s" % (e))
+
+    async def send_editlist(self, lst: ServerList):
+        assert self.cur_msg
+
+        curtime = time.time()
+
+        try:
+            with self.tracer.span('build_embed') as span:
+                embed = self.build_serverlist_embed(lst)
+                span.count('fields', len(embed.fields))
+            with self.tracer.span('discord_edit'):
+                await self.cur_msg.edit(embed=embed)
+            self.last_action_time = curtime
+            logger.info("Edited existing list.")
+        except Exception as e:
+            logger.error(
+                "Failed to edit existing list. Exception: %s" % (e))
+
+    async def remove_oldlist(self):
+        try:
+            if self.cur_msg:
+                with self.tracer.span('discord_delete'):
+                    await self.cur_msg.delete()
+                self.cur_msg = None
+                logger.info("Removed old list.")
+        except Exception as e:
+            logger.error(
+                "Failed to remove old list. Exception: %s" % (e))
+
+    @staticmethod
+    def get_persistent_last_msg_name():
+        return path.join(
+            path.dirname(__file__), ".persistent_lastmsg.txt")
+
+    def read_persistent_last_msg(self):
+        file_name = self.get_persistent_last_msg_name()
+        try:
+            with open(file_name, "r") as fp:
+                self.persistent_msg_id = int(fp.read())
+        except IOError:
+            pass
+
+    def write_persistent_last_msg(self):
+        assert self.cur_msg
+        file_name = self.get_persistent_last_msg_name()
+        with open(file_name, "w") as fp:
+            fp.write(str(self.cur_msg.id) + "\n")
+        self.persistent_msg_id = self.cur_msg.id
@@ -0,0 +1,727 @@
+# Standard libraries
+import time
+import math
+import asyncio
+import random
+from collections import deque
+import configparser
+import sys
+from os import path
+import logging
+import contextlib
+import contextvars
+import threading
+from collections import Counter
+
+
+LOG_FORMAT = '%(asctime)s | %(message)s'
+
+# Shortest timeout we will ever wait for a single A2S request.
+PROBE_MIN_TIMEOUT = 0.5
+# Learned timeout is this many times the server's p90 round trip time.
+PROBE_TIMEOUT_FACTOR = 3.0
+# Retry timeouts are scattered by this fraction so retries don't line up.
+PROBE_RETRY_JITTER = 0.25
+# How many round trip times we keep per server and in total.
+PROBE_SERVER_SAMPLES = 10
+PROBE_TOTAL_SAMPLES = 100
+# We don't hedge until we have seen this many replies.
+PROBE_HEDGE_MIN_SAMPLES = 5
+
+# How often the sampling profiler looks at the stack (in seconds).
+PROFILE_INTERVAL = 0.005
+# How many of the most common stacks we log for a slow cycle.
+PROFILE_TOP_STACKS = 20
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+def value_cap_min(value, minval, def_value):
+    if value > minval:
+        return value
+    else:
+        return def_value
+
+
+def address_to_str(address: tuple[str, int]):
+    if address[1] == 0:
+        # No port
+        return address[0]
+    else:
+        # Port exists
+        return ("%s:%i" % (address[0], address[1]))
+
+
+def address_equals(a1: tuple[str, int], a2: tuple[str, int]):
+    # Same host
+    if a1[0] == a2[0]:
+        # If port is 0, ignore it
+        if a1[1] == 0 or a2[1] == 0:
+            return True
+        elif a1[1] == a2[1]:
+            return True
+    return False
+
+
+def parse_ips(ip_list: str):
+    lst: list[tuple[str, int]] = []
+
+    for address in ip_list.split(','):
+        ip = address.split(':')
+        ip[0] = ip[0].strip()
+
+        if not ip[0]:
+            continue
+
+        try:
+            ip_port = 0 if len(ip) <= 1 else int(ip[1])
+        except ValueError:
+            raise ValueError("invalid port in address '%s'" % address.strip())
+
+        logger.debug("Parsed ip %s (%s)!" % (ip[0], ip_port))
+        lst.append((ip[0], ip_port))
+
+    return lst
+
+
+def percentile(values, pct: float):
+    """Nearest-rank percentile of the values. pct is between 0 and 100."""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+class ServerList():
+    def __init__(self):
+        self.servers: list[ServerData] = []
+        self.query_time = time.time()
+
+    def add_server(self, new_srv: 'ServerData'):
+        for srv in self.servers:
+            if srv.equals(new_srv):
+                return False
+
+        self.servers.append(new_srv)
+        return True
+
+    def update(self, new_srv_list: 'ServerList', max_unresponsive_time: float | int):
+        insert: list[ServerData] = []
+        not_found: list[ServerData] = []
+        updated = 0
+
+        self.query_time = new_srv_list.query_time
+
+        # Find all unresponsive servers.
+        for srv in self.servers:
+            found = False
+            for new_srv in new_srv_list.servers:
+                if srv.equals(new_srv):
+                    found = True
+                    break
+            if not found:
+                not_found.append(srv)
+
+        # Find all new servers and update existing ones.
+        for new_srv in new_srv_list.servers:
+            found = False
+            for srv in self.servers:
+                if srv.equals(new_srv):
+                    if srv.should_update(new_srv):
+                        updated = updated + 1
+
+                    srv.copy(new_srv)
+                    found = True
+                    break
+            if not found:
+                insert.append(new_srv)
+
+        # Insert new ones
+        self.servers.extend(insert)
+
+        # Update unresponsive servers.
+        for srv in not_found:
+            srv.set_unresponsive()
+
+            # Remove them from list
+            if max_unresponsive_time >= 0:
+                unresp_time = time.time() - srv.unresponsive_time
+                if unresp_time > max_unresponsive_time:
+                    logger.info(
+                        "Removing unresponsive server '%s' from list." %
+                        (srv.server_name))
+                    self.servers.remove(srv)
+
+        if updated > 0 or len(insert) > 0 or len(not_found) > 0:
+            logger.info("Updated %i servers! %i new & %i not found servers." %
+                        (updated, len(insert), len(not_found)))
+            return True
+
+        return False
+
+    def get_addresses(self):
+        """Returns all addresses we should query."""
+        addresses: list[tuple[str, int]] = []
+        for srv in self.servers:
+            addresses.append(srv.address)
+        return addresses
+
+    def equals(self, lst: 'ServerList'):
+        if len(lst.servers) != len(self.servers):
+            return False
+
+        for srv1 in self.servers:
+            found = False
+            for srv2 in lst.servers:
+                if srv1.equals(srv2):
+                    found = True
+                    break
+            if not found:
+                return False
+
+        return True
+
+
+class ServerData():
+    def __init__(self, address: tuple[str, int]):
+        self.address = address
+
+        self.queried = False
+
+        self.ply_count = 0
+        self.max_ply_count = 0
+        self.server_name = ''
+        self.map_name = ''
+
+        # When we lost connection to server for the first time
+        self.unresponsive_time = 0
+
+        self.last_query_time = 0
+
+    def equals(self, srv: 'ServerData'):
+        if srv == self:
+            return True
+
+        if self.full_socket == srv.full_socket:
+            return True
+
+        return False
+
+    def should_update(self, srv):
+        if not self.queried:
+            return True
+
+        if self.ply_count != srv.ply_count:
+            return True
+        if self.max_ply_count != srv.max_ply_count:
+            return True
+        if self.server_name != srv.server_name:
+            return True
+        if self.map_name != srv.map_name:
+            return True
+
+        return False
+
+    def copy(self, srv: 'ServerData'):
+        self.ply_count = srv.ply_count
+        self.max_ply_count = srv.max_ply_count
+        self.server_name = srv.server_name
+        self.map_name = srv.map_name
+
+        self.last_query_time = srv.last_query_time
+
+        self.set_responsive()
+
+    def update_info(self, info):
+        # Ignore bots if possible.
+        self.ply_count = info.player_count - info.bot_count
+        self.max_ply_count = info.max_players
+        self.server_name = info.server_name
+        self.map_name = info.map_name
+
+        self.last_query_time = time.time()
+
+        self.queried = True
+
+    @property
+    def is_unresponsive(self):
+        return self.unresponsive_time != 0
+
+    def set_unresponsive(self):
+        if not self.is_unresponsive:
+            self.unresponsive_time = time.time()
+
+    def set_responsive(self):
+        self.unresponsive_time = 0
+
+    @property
+    def full_socket(self):
+        return "%s:%i" % (self.address[0], self.address[1])
+
+
+class ServerListConfig:
+    def __init__(self, config: configparser.ConfigParser):
+        self.embed_title = config.get('config', 'embed_title')
+
+        self.embed_max = config.getint('config', 'embed_max', fallback=1)
+        self.embed_max = 1 if self.embed_max < 1 else self.embed_max
+
+        self.embed_color = int(config.get(
+            'config', 'embed_color', fallback='0x0'), base=16)
+
+        self.gamedir = config.get('config', 'gamedir')
+
+        self.max_total_query_time = config.getfloat(
+            'config', 'max_total_query_time', fallback=30)
+        self.max_total_query_time = value_cap_min(
+            self.max_total_query_time, 0, 30)
+
+        self.query_interval = config.getfloat(
+            'config', 'query_interval', fallback=100)
+        self.query_interval = value_cap_min(
+            self.query_interval, 0, 100)
+
+        self.server_query_interval = config.getfloat(
+            'config', 'server_query_interval', fallback=20)
+        self.server_query_interval = value_cap_min(
+            self.server_query_interval, 0, 20)
+
+        self.max_new_msgs = config.getint('config', 'max_new_msgs', fallback=5)
+
+        self.max_unresponsive_time = config.getfloat(
+            'config', 'max_unresponsive_time', fallback=0)
+
+        self.query_timeout = config.getfloat(
+            'config', 'query_timeout', fallback=3)
+        self.query_timeout = value_cap_min(
+            self.query_timeout, 0, 3)
+
+        self.query_retries = config.getint(
+            'config', 'query_retries', fallback=2)
+        self.query_retries = 0 if self.query_retries < 0 else self.query_retries
+
+        self.max_concurrent_queries = config.getint(
+            'config', 'max_concurrent_queries', fallback=10)
+        self.max_concurrent_queries = value_cap_min(
+            self.max_concurrent_queries, 0, 10)
+
+        self.slow_cycle_threshold = config.getfloat(
+            'config', 'slow_cycle_threshold', fallback=10)
+
+        self.slow_cycle_profile = config.getboolean(
+            'config', 'slow_cycle_profile', fallback=False)
+
+        self.upper_format = config.get('config', 'upper_format')
+        self.lower_format = config.get('config', 'lower_format')
+
+
+class ProbePolicy:
+    """Decides how long we wait for A2S replies.
+    Learns per-server timeouts from recent round trip times, retries lost
+    packets with short jittered timeouts and sends a hedge request when a
+    server is slower than the p90 of everything we've seen.
+    Earlier requests keep listening while we retry, so a late reply still
+    counts. A server never takes longer than query_timeout in total."""
+
+    def __init__(self, query_timeout: float, query_retries: int):
+        self.query_timeout = query_timeout
+        self.query_retries = query_retries
+        self.server_rtts: dict[str, deque[float]] = {}
+        self.all_rtts: deque[float] = deque(maxlen=PROBE_TOTAL_SAMPLES)
+
+    @staticmethod
+    def get_key(address: tuple[str, int]):
+        return address_to_str(address)
+
+    def record(self, address: tuple[str, int], rtt: float):
+        key = self.get_key(address)
+        if key not in self.server_rtts:
+            self.server_rtts[key] = deque(maxlen=PROBE_SERVER_SAMPLES)
+        self.server_rtts[key].append(rtt)
+        self.all_rtts.append(rtt)
+
+    def prune(self, addresses: list[tuple[str, int]]):
+        """Forgets servers that aren't in the addresses anymore."""
+        keys = set(self.get_key(address) for address in addresses)
+        for key in list(self.server_rtts.keys()):
+            if key not in keys:
+                del self.server_rtts[key]
+
+    def get_timeout(self, address: tuple[str, int], attempt: int = 0):
+        """How long we wait for an attempt before retrying.
+        Unknown servers split the query timeout between all attempts."""
+        rtts = self.server_rtts.get(self.get_key(address))
+        if rtts:
+            timeout = percentile(rtts, 90) * PROBE_TIMEOUT_FACTOR
+            timeout = min(max(timeout, PROBE_MIN_TIMEOUT), self.query_timeout)
+        else:
+            timeout = max(self.query_timeout / (self.query_retries + 1),
+                          PROBE_MIN_TIMEOUT)
+
+        if attempt > 0:
+            timeout *= random.uniform(
+                1 - PROBE_RETRY_JITTER, 1 + PROBE_RETRY_JITTER)
+
+        return timeout
+
+    def get_hedge_delay(self, address: tuple[str, int]):
+        """Returns how long we wait before hedging, or None if we don't
+        know enough yet.
+        Servers that are always slow are only hedged when they're slower
+        than usual for them."""
+        if len(self.all_rtts) < PROBE_HEDGE_MIN_SAMPLES:
+            return None
+
+        delay = percentile(self.all_rtts, 90)
+        rtts = self.server_rtts.get(self.get_key(address))
+        if rtts:
+            delay = max(delay, percentile(rtts, 90))
+        return delay
+
+    async def query(self, address: tuple[str, int]):
+        """Queries server info. Raises the last error if all attempts fail.
+        All attempts together take at most query_timeout."""
+        # Module: python-a2s
+        import a2s
+
+        async def request(request_timeout: float):
+            start = time.monotonic()
+            info = await a2s.ainfo(address, timeout=request_timeout)
+            return info, time.monotonic() - start
+
+        start = time.monotonic()
+        deadline = start + self.query_timeout
+        requests: set[asyncio.Task] = set()
+        attempt = 0
+
+        def send():
+            requests.add(asyncio.create_task(
+                request(deadline - time.monotonic())))
+
+        send()
+        retry_time = start + self.get_timeout(address, attempt)
+        hedge_time = None
+        hedge_delay = self.get_hedge_delay(address)
+        if hedge_delay is not None and start + hedge_delay < retry_time:
+            hedge_time = start + hedge_delay
+
+        try:
+            while True:
+                curtime = time.monotonic()
+                if curtime >= deadline:
+                    break
+
+                if hedge_time is not None and curtime >= hedge_time:
+                    logger.debug("Hedging query to slow server %s." %
+                                 address_to_str(address))
+                    send()
+                    hedge_time = None
+
+                # Retry right away if nothing is listening anymore.
+                if attempt < self.query_retries and (
+                        curtime >= retry_time or not requests):
+                    attempt += 1
+                    logger.debug("Server %s timed out, retrying (%i)..." %
+                                 (address_to_str(address), attempt))
+                    send()
+                    retry_time = curtime + self.get_timeout(address, attempt)
+
+                if not requests:
+                    break
+
+                wake_time = deadline
+                if attempt < self.query_retries:
+                    wake_time = min(wake_time, retry_time)
+                if hedge_time is not None:
+                    wake_time = min(wake_time, hedge_time)
+
+                done, requests = await asyncio.wait(
+                    requests, timeout=max(wake_time - time.monotonic(), 0),
+                    return_when=asyncio.FIRST_COMPLETED)
+
+                # First successful reply wins.
+                for req in done:
+                    error = req.exception()
+                    if error is None:
+                        info, rtt = req.result()
+                        self.record(address, rtt)
+                        return info
+                    if not isinstance(error, asyncio.TimeoutError):
+                        raise error
+        finally:
+            for req in requests:
+                req.cancel()
+
+        raise asyncio.TimeoutError()
+
+
+class TraceSpan:
+    """A timed phase of an update cycle. Spans nest, the outermost
+    span is the whole cycle."""
+
+    def __init__(self, name: str, parent: 'TraceSpan | None'):
+        self.name = name
+        self.parent = parent
+        self.children: list[TraceSpan] = []
+        # Spans from other trees this one waited for.
+        self.links: list[TraceSpan] = []
+        self.counts: dict[str, int] = {}
+        self.start = time.perf_counter()
+        self.end = 0.0
+
+    @property
+    def duration(self):
+        end = self.end if self.end else time.perf_counter()
+        return end - self.start
+
+    def count(self, key: str, value: int = 1):
+        self.counts[key] = self.counts.get(key, 0) + value
+
+    def link(self, span: 'TraceSpan'):
+        self.links.append(span)
+
+    def find(self, name: str):
+        """Returns the first span with the name in this tree."""
+        if self.name == name:
+            return self
+        for child in self.children:
+            span = child.find(name)
+            if span:
+                return span
+        return None
+
+    def format(self, depth: int = 0, marker: str = ''):
+        line = "%s%s%s %.3fs" % (
+            "  " * depth, marker, self.name, self.duration)
+        for key, value in self.counts.items():
+            line += " %s=%i" % (key, value)
+
+        lines = [line]
+        for child in self.children:
+            lines.extend(child.format(depth + 1))
+        for link in self.links:
+            lines.extend(link.format(depth + 1, '-> '))
+        return lines
+
+
+# The span we're currently in. Tasks inherit it from whoever created them.
+current_span: contextvars.ContextVar[TraceSpan | None] = \
+    contextvars.ContextVar('current_span', default=None)
+
+
+class SamplingProfiler:
+    """Samples the event loop thread's stack, and any thread inside
+    sample_thread, while there are cycles running.
+    Sleeps when there aren't any."""
+
+    def __init__(self, interval: float = PROFILE_INTERVAL):
+        self.interval = interval
+        self.profiles: dict[TraceSpan, Counter[str]] = {}
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread: threading.Thread | None = None
+        self.thread_id = 0
+        self.extra_thread_ids: set[int] = set()
+
+    def start(self, span: TraceSpan):
+        with self.lock:
+            self.profiles[span] = Counter()
+            self.thread_id = threading.get_ident()
+            self.wakeup.set()
+
+        if not self.thread:
+            self.thread = threading.Thread(
+                target=self.run, name='ssdb-profiler', daemon=True)
+            self.thread.start()
+
+    def stop(self, span: TraceSpan):
+        """Returns how many times each stack was seen during the span."""
+        with self.lock:
+            profile = self.profiles.pop(span, Counter())
+            if not self.profiles:
+                self.wakeup.clear()
+        return profile
+
+    @contextlib.contextmanager
+    def sample_thread(self):
+        """Also samples the calling thread, e.g. executor work
+        the event loop is waiting for."""
+        thread_id = threading.get_ident()
+        with self.lock:
+            self.extra_thread_ids.add(thread_id)
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.extra_thread_ids.discard(thread_id)
+
+    def run(self):
+        while True:
+            self.wakeup.wait()
+            time.sleep(self.interval)
+
+            with self.lock:
+                if not self.profiles:
+                    continue
+                frames = sys._current_frames()
+                for thread_id in (self.thread_id, *self.extra_thread_ids):
+                    frame = frames.get(thread_id)
+                    if not frame:
+                        continue
+                    stack = self.collapse_stack(frame)
+                    for profile in self.profiles.values():
+                        profile[stack] += 1
+
+    @staticmethod
+    def collapse_stack(frame):
+        """Outermost call first, separated by semicolons."""
+        names = []
+        while frame:
+            code = frame.f_code
+            names.append("%s (%s:%i)" % (
+                code.co_name, path.basename(code.co_filename), frame.f_lineno))
+            frame = frame.f_back
+        return ";".join(reversed(names))
+
+
+class Tracer:
+    """Records the phases of update cycles as spans.
+    Logs the span tree, and optionally a stack profile, of cycles
+    that take longer than the slow cycle threshold."""
+
+    def __init__(self, slow_cycle_threshold: float, profile: bool = False):
+        self.slow_cycle_threshold = slow_cycle_threshold
+        self.profiler = SamplingProfiler() if profile else None
+        self.last_cycle: TraceSpan | None = None
+
+    @contextlib.contextmanager
+    def span(self, name: str, root: bool = False):
+        """Starts a span under the current one.
+        Root spans start a new cycle even inside another span."""
+        parent = None if root else current_span.get()
+        span = TraceSpan(name, parent)
+        if parent:
+            parent.children.append(span)
+        elif self.profiler:
+            self.profiler.start(span)
+
+        token = current_span.set(span)
+        try:
+            yield span
+        finally:
+            span.end = time.perf_counter()
+            current_span.reset(token)
+            if not parent:
+                self.end_cycle(span)
+
+    def sample_thread(self):
+        """Lets the profiler see blocking work done in another thread."""
+        if not self.profiler:
+            return contextlib.nullcontext()
+        return self.profiler.sample_thread()
+
+    def end_cycle(self, span: TraceSpan):
+        self.last_cycle = span
+
+        profile = self.profiler.stop(span) if self.profiler else None
+
+        if self.slow_cycle_threshold <= 0:
+            return
+        if span.duration <= self.slow_cycle_threshold:
+            return
+
+        logger.warning("Slow cycle took %.3fs (threshold %.3fs):\n%s" % (
+            span.duration, self.slow_cycle_threshold,
+            "\n".join(span.format())))
+
+        if profile:
+            lines = ["%i %s" % (count, stack)
+                     for stack, count in profile.most_common(PROFILE_TOP_STACKS)]
+            logger.warning("Slow cycle profile (%i samples, top stacks):\n%s" % (
+                profile.total(), "\n".join(lines)))
+
+
+def validate_config(config: configparser.ConfigParser):
+    """Checks the config before we load anything heavy.
+    Raises ValueError or configparser.Error if the bot can't run with it."""
+    srv_config = ServerListConfig(config)
+
+    if not config.get('config', 'token', fallback='').strip():
+        raise ValueError("token is not set")
+
+    try:
+        config.getint('config', 'channel', fallback=0)
+    except ValueError:
+        raise ValueError("channel is not a channel id")
+
+    serverlist = parse_ips(config.get('config', 'serverlist', fallback=''))
+    parse_ips(config.get('config', 'blacklist', fallback=''))
+
+    if not serverlist and not srv_config.gamedir.strip():
+        raise ValueError("either serverlist or gamedir has to be set")
+
+    kwargs = {
+        "name": "",
+        "address": "",
+        "map": "",
+        "players": 0,
+        "max_players": 0
+    }
+    for option in ('upper_format', 'lower_format'):
+        try:
+            getattr(srv_config, option).format(**kwargs)
+        except (KeyError, IndexError, ValueError) as e:
+            raise ValueError("invalid %s: %s" % (option, e))
+
+
+def main(config_name: str, run_client=None):
+    """Reads and checks the config, then runs the bot.
+    Returns the exit code.
+    run_client(client_class, config) is called instead of logging in,
+    so benchmarks can start the bot the same way we do."""
+    # Read our config
+    config = configparser.ConfigParser()
+    with open(config_name, 'r') as fp:
+        config.read_file(fp)
+
+    # Init logger
+    log_level_str = config.get(
+        'config', 'logging', fallback='').upper()
+    log_level = getattr(logging, log_level_str, logging.WARNING)
+    ch = logging.StreamHandler()
+    ch.setLevel(log_level)
+    formatter = logging.Formatter(LOG_FORMAT)
+    ch.setFormatter(formatter)
+    logger.addHandler(ch)
+
+    try:
+        validate_config(config)
+    except (configparser.Error, ValueError) as e:
+        logger.error("Invalid config: %s" % e)
+        return 1
+
+    # Importing discord.py takes a while, only do it once we know
+    # the config is good.
+    # Module: discord.py
+    import discord
+    from ssdb_client import ServerListClient
+
+    if run_client:
+        return run_client(ServerListClient, config)
+
+    exitcode = 0
+
+    # Run the bot
+    client = ServerListClient(config)
+    try:
+        client.run(config.get('config', 'token'))
+    except discord.LoginFailure:
+        logger.error("Failed to log in! Make sure your token is correct!")
+        exitcode = 1
+    except Exception as e:
+        logger.error("Discord bot ended unexpectedly: " + str(e))
+        exitcode = 2
+
+    return exitcode
@@ -1,5 +1,15 @@
+import asyncio
+import configparser
+import threading
+import time
 import unittest
-from ssdb import ServerList, ServerData, address_equals
+from types import SimpleNamespace
+from unittest import mock
+from ssdb_core import (ServerList, ServerData, ProbePolicy, address_equals,
+                       percentile, PROBE_MIN_TIMEOUT, PROBE_HEDGE_MIN_SAMPLES,
+                       Tracer, current_span, parse_ips, validate_config)
+from ssdb_client import ServerListClient
+from fake_discord import FakeDiscord, FakeClientMixin
 
 
 class SsdbTests(unittest.TestCase):
@@ -46,6 +56,388 @@ class SsdbTests(unittest.TestCase):
         self.assertFalse(address_equals(("127.0.0.1", 0), ("127.0.0.2", 27015)))
         self.assertFalse(address_equals(("127.0.0.2", 27015), ("127.0.0.1", 0)))
 
+    def test_parse_ips(self):
+        self.assertEqual(parse_ips(" 127.0.0.1:27015, 127.0.0.2,"),
+                         [("127.0.0.1", 27015), ("127.0.0.2", 0)])
+        with self.assertRaises(ValueError):
+            parse_ips("127.0.0.1:abc")
+
+    def test_validate_config(self):
+        config = configparser.ConfigParser()
+        config.read_dict({'config': {
+            'token': 'token',
+            'channel': '1',
+            'serverlist': '127.0.0.1:27015',
+            'blacklist': '',
+            'gamedir': '',
+            'embed_title': 'Servers',
+            'upper_format': '{players}/{max_players} | {name}',
+            'lower_format': 'Map: {map}',
+        }})
+        validate_config(config)
+
+        config.set('config', 'serverlist', '127.0.0.1:abc')
+        with self.assertRaisesRegex(ValueError, "invalid port"):
+            validate_config(config)
+
+        config.set('config', 'serverlist', '')
+        config.set('config', 'gamedir', 'tf')
+        config.set('config', 'blacklist', '1.2.3.4:abc')
+        with self.assertRaisesRegex(ValueError, "invalid port"):
+            validate_config(config)
+
+        config.set('config', 'blacklist', '')
+        config.set('config', 'lower_format', '{mapname}')
+        with self.assertRaisesRegex(ValueError, "lower_format"):
+            validate_config(config)
+
+    def test_percentile(self):
+        self.assertEqual(percentile([], 90), 0.0)
+        self.assertEqual(percentile([3, 1, 2], 50), 2)
+        self.assertEqual(percentile(range(1, 11), 90), 9)
+        self.assertEqual(percentile(range(1, 11), 100), 10)
+
+
+class ProbePolicyTests(unittest.IsolatedAsyncioTestCase):
+    address = ("127.0.0.1", 27015)
+
+    def test_timeout_unknown(self):
+        policy = ProbePolicy(3, 2)
+        self.assertAlmostEqual(policy.get_timeout(self.address), 1)
+
+    def test_timeout_learned(self):
+        policy = ProbePolicy(3, 2)
+        for _ in range(5):
+            policy.record(self.address, 0.4)
+        self.assertAlmostEqual(policy.get_timeout(self.address), 1.2)
+
+        policy.record(self.address, 0.01)
+        policy.record(self.address, 0.01)
+        self.assertAlmostEqual(policy.get_timeout(self.address), 1.2)
+
+        policy = ProbePolicy(3, 2)
+        policy.record(self.address, 0.01)
+        self.assertEqual(policy.get_timeout(self.address), PROBE_MIN_TIMEOUT)
+        policy.record(self.address, 10)
+        self.assertEqual(policy.get_timeout(self.address), 3)
+
+    def test_hedge_delay(self):
+        policy = ProbePolicy(3, 2)
+        for _ in range(PROBE_HEDGE_MIN_SAMPLES - 1):
+            policy.record(self.address, 0.1)
+        self.assertIsNone(policy.get_hedge_delay(self.address))
+        policy.record(self.address, 0.1)
+        self.assertEqual(policy.get_hedge_delay(self.address), 0.1)
+
+        # Slow servers are hedged by their own p90.
+        slow_address = ("127.0.0.2", 27015)
+        self.assertEqual(policy.get_hedge_delay(slow_address), 0.1)
+        policy.record(slow_address, 0.5)
+        self.assertEqual(policy.get_hedge_delay(slow_address), 0.5)
+
+    def test_prune(self):
+        policy = ProbePolicy(3, 2)
+        policy.record(self.address, 0.1)
+        policy.record(("127.0.0.2", 27015), 0.1)
+        policy.prune([self.address])
+        self.assertEqual(list(policy.server_rtts.keys()), ["127.0.0.1:27015"])
+
+    async def test_query_retries(self):
+        policy = ProbePolicy(3, 2)
+        with mock.patch("a2s.ainfo",
+                        side_effect=[asyncio.TimeoutError(), "info"]) as ainfo:
+            self.assertEqual(await policy.query(self.address), "info")
+        self.assertEqual(ainfo.call_count, 2)
+
+        with mock.patch("a2s.ainfo",
+                        side_effect=asyncio.TimeoutError()) as ainfo:
+            with self.assertRaises(asyncio.TimeoutError):
+                await policy.query(self.address)
+        self.assertEqual(ainfo.call_count, 3)
+
+    async def test_query_budget(self):
+        # Learned timeout is longer than the whole budget.
+        policy = ProbePolicy(0.3, 2)
+        policy.record(self.address, 1)
+
+        timeouts = []
+
+        async def ainfo_side_effect(address, timeout):
+            timeouts.append(timeout)
+            await asyncio.sleep(timeout)
+            raise asyncio.TimeoutError()
+
+        start = time.monotonic()
+        with mock.patch("a2s.ainfo", side_effect=ainfo_side_effect):
+            with self.assertRaises(asyncio.TimeoutError):
+                await policy.query(self.address)
+        self.assertLess(time.monotonic() - start, 0.4)
+        self.assertLessEqual(max(timeouts), 0.3)
+
+    async def test_query_slow_server(self):
+        # Replies after the first retry was sent, but before the deadline.
+        policy = ProbePolicy(3, 2)
+
+        async def ainfo_side_effect(address, timeout):
+            await asyncio.sleep(min(1.3, timeout))
+            if timeout < 1.3:
+                raise asyncio.TimeoutError()
+            return "info"
+
+        with mock.patch("a2s.ainfo", side_effect=ainfo_side_effect) as ainfo:
+            self.assertEqual(await policy.query(self.address), "info")
+        self.assertEqual(ainfo.call_count, 2)
+        self.assertEqual(len(policy.server_rtts["127.0.0.1:27015"]), 1)
+
+    async def test_query_hedge(self):
+        policy = ProbePolicy(3, 0)
+        for _ in range(PROBE_HEDGE_MIN_SAMPLES):
+            policy.record(("127.0.0.2", 27015), 0.01)
+
+        calls = []
+
+        async def ainfo_side_effect(address, timeout):
+            calls.append(timeout)
+            if len(calls) == 1:
+                # First request is lost.
+                await asyncio.sleep(timeout)
+                raise asyncio.TimeoutError()
+            return "info"
+
+        with mock.patch("a2s.ainfo", side_effect=ainfo_side_effect) as ainfo:
+            self.assertEqual(await policy.query(self.address), "info")
+        self.assertEqual(ainfo.call_count, 2)
+        self.assertEqual(len(policy.server_rtts["127.0.0.1:27015"]), 1)
+
+
+class FakeServerListClient(FakeClientMixin, ServerListClient):
+    pass
+
+
+async def fake_ainfo(address, timeout=3.0, encoding='utf-8'):
+    return SimpleNamespace(player_count=1, bot_count=0, max_players=8,
+                           server_name="Server", map_name="dm_test")
+
+
+class ClientTests(unittest.IsolatedAsyncioTestCase):
+    def create_client(self, **channel_kwargs):
+        config = configparser.ConfigParser()
+        config.read_dict({'config': {
+            'channel': '1',
+            'serverlist': '127.0.0.1:27015',
+            'gamedir': '',
+            'embed_title': 'Servers',
+            'max_new_msgs': '5',
+            'upper_format': '{players}/{max_players} | {name}',
+            'lower_format': 'Map: {map}',
+        }})
+        self.fake = FakeDiscord()
+        self.channel = self.fake.add_channel(1, **channel_kwargs)
+        client = FakeServerListClient(config)
+        self.fake.attach(client)
+        return client
+
+    async def asyncSetUp(self):
+        patcher = mock.patch("a2s.ainfo", side_effect=fake_ainfo)
+        self.ainfo = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_ready_prints_list(self):
+        client = self.create_client()
+        await client.on_ready()
+        await self.fake.drain()
+        self.assertEqual(self.channel.sends, 1)
+        self.assertEqual(client.cur_msg, self.channel.messages[-1])
+        self.assertEqual(client.num_other_msgs, 0)
+
+    async def test_command_prints_list(self):
+        client = self.create_client()
+        await client.on_ready()
+        await self.fake.drain()
+
+        # Too soon to query again.
+        self.channel.post("!servers")
+        await self.fake.drain()
+        self.assertEqual(self.channel.edits, 0)
+
+        client.last_query_time = 0
+        self.channel.post("hello")
+        self.channel.post("!servers")
+        await self.fake.drain()
+        self.assertEqual(self.channel.sends, 1)
+        self.assertEqual(self.channel.edits, 1)
+
+    async def test_shared_query(self):
+        client = self.create_client()
+        await asyncio.gather(client.get_serverlist(), client.get_serverlist())
+        self.assertEqual(self.ainfo.call_count, 1)
+        self.assertIsNone(client.query_task)
+
+    async def test_new_list_after_messages(self):
+        client = self.create_client()
+        await client.on_ready()
+        await self.fake.drain()
+        old_msg = client.cur_msg
+
+        # Let the list be queried again.
+        client.last_query_time = 0
+        for _ in range(6):
+            self.channel.post("hello")
+        self.channel.post("!list")
+        await self.fake.drain()
+
+        self.assertEqual(self.channel.sends, 2)
+        self.assertEqual(self.channel.deletes, 1)
+        self.assertNotIn(old_msg, self.channel.messages)
+        self.assertEqual(client.cur_msg, self.channel.messages[-1])
+
+    async def test_rate_limited(self):
+        client = self.create_client(rate_limit=1, rate_limit_period=0.05)
+        await client.on_ready()
+        client.last_query_time = 0
+        await client.print_list()
+        await self.fake.drain()
+
+        # The edit waits for the bucket instead of failing.
+        self.assertEqual(self.channel.sends, 1)
+        self.assertEqual(self.channel.edits, 1)
+        self.assertEqual(self.channel.rate_limited, 1)
+        self.assertGreater(self.channel.rate_limit_wait, 0)
+
+    async def test_cycle_spans(self):
+        client = self.create_client()
+        await client.on_ready()
+
+        cycle = client.tracer.last_cycle
+        self.assertEqual(cycle.name, "print_list")
+        self.assertEqual(
+            [span.name for span in cycle.children],
+            ["wait_query", "build_embed", "discord_send"])
+        self.assertEqual(cycle.find("build_embed").counts, {"fields": 1})
+
+        # The query is its own cycle, linked from where we waited for it.
+        query = cycle.find("wait_query").links[0]
+        self.assertEqual(query.name, "update_serverlist")
+        self.assertEqual(
+            [span.name for span in query.children],
+            ["query_servers", "serverlist_update"])
+        self.assertEqual(query.find("query_servers").counts,
+                         {"servers": 1, "timed_out": 0, "online": 1})
+        self.assertIn("    -> update_serverlist", "\n".join(cycle.format()))
+
+    async def test_startup_single_send(self):
+        client = self.create_client(http_latency=0.01)
+
+        async def slow_ainfo(address, timeout=3.0, encoding='utf-8'):
+            await asyncio.sleep(0.05)
+            return await fake_ainfo(address)
+
+        self.ainfo.side_effect = slow_ainfo
+        await client.setup_hook()
+        await asyncio.gather(client.on_ready(), client.print_list(),
+                             client.print_list())
+        await self.fake.drain()
+        client.update_task.cancel()
+
+        self.assertEqual(self.ainfo.call_count, 1)
+        self.assertEqual(self.channel.sends, 1)
+        self.assertEqual(self.channel.deletes, 0)
+        self.assertEqual(client.cur_msg, self.channel.messages[-1])
+
+    async def test_event_context(self):
+        client = self.create_client()
+        spans = []
+
+        async def on_message(message):
+            spans.append(current_span.get())
+
+        client.on_message = on_message
+        with client.tracer.span("cycle"):
+            self.channel.post("hello")
+        await self.fake.drain()
+        self.assertEqual(spans, [None])
+
+    async def test_startup_spans(self):
+        client = self.create_client()
+        with mock.patch.object(client.tracer, "end_cycle",
+                               wraps=client.tracer.end_cycle) as end_cycle:
+            await client.setup_hook()
+            await client.on_ready()
+        client.update_task.cancel()
+
+        cycles = [call.args[0] for call in end_cycle.call_args_list]
+        self.assertEqual([cycle.name for cycle in cycles],
+                         ["update_serverlist", "print_list"])
+        query, print_list = cycles
+        self.assertEqual(
+            [span.name for span in query.children],
+            ["query_servers", "serverlist_update"])
+        self.assertEqual(
+            [span.name for span in print_list.children],
+            ["wait_query", "build_embed", "discord_send"])
+        self.assertIs(print_list.find("wait_query").links[0], query)
+
+    async def test_query_servers_counts(self):
+        client = self.create_client()
+        with client.tracer.span("cycle"):
+            await client.query_servers([])
+        self.assertEqual(client.tracer.last_cycle.find("query_servers").counts,
+                         {"servers": 0, "timed_out": 0, "online": 0})
+
+
+class TracerTests(unittest.TestCase):
+    def test_nested_spans(self):
+        tracer = Tracer(0)
+        with tracer.span("cycle") as cycle:
+            with tracer.span("phase") as phase:
+                phase.count("servers", 2)
+                phase.count("servers")
+
+        self.assertIs(tracer.last_cycle, cycle)
+        self.assertEqual(cycle.children, [phase])
+        self.assertEqual(phase.counts, {"servers": 3})
+        self.assertGreaterEqual(cycle.duration, phase.duration)
+
+    def test_slow_cycle(self):
+        tracer = Tracer(0.01)
+        with self.assertNoLogs("ssdb_core", "WARNING"):
+            with tracer.span("fast"):
+                pass
+
+        with self.assertLogs("ssdb_core", "WARNING") as logs:
+            with tracer.span("slow"):
+                with tracer.span("phase"):
+                    time.sleep(0.02)
+        self.assertIn("Slow cycle", logs.output[0])
+        self.assertIn("  phase", logs.output[0])
+
+    def test_slow_cycle_profile(self):
+        tracer = Tracer(0.01, profile=True)
+        with self.assertLogs("ssdb_core", "WARNING") as logs:
+            with tracer.span("slow"):
+                end = time.perf_counter() + 0.1
+                while time.perf_counter() < end:
+                    pass
+        self.assertEqual(len(logs.output), 2)
+        self.assertIn("test_slow_cycle_profile", logs.output[1])
+
+    def test_slow_cycle_profile_thread(self):
+        tracer = Tracer(0.01, profile=True)
+
+        def busy_thread():
+            with tracer.sample_thread():
+                end = time.perf_counter() + 0.1
+                while time.perf_counter() < end:
+                    pass
+
+        with self.assertLogs("ssdb_core", "WARNING") as logs:
+            with tracer.span("slow"):
+                thread = threading.Thread(target=busy_thread)
+                thread.start()
+                thread.join()
+        self.assertEqual(len(logs.output), 2)
+        self.assertIn("busy_thread", logs.output[1])
+
 
 if __name__ == "__main__":
     unittest.main()